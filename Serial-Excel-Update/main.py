@@ -16,7 +16,12 @@ Requirements:
 import serial
 import serial.tools.list_ports
 import csv
+import gzip
+import json
+import selectors
+import shutil
 import smtplib
+import re
 import time
 import os
 from datetime import datetime
@@ -25,14 +30,23 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 from threading import Thread, Event
+from concurrent.futures import ThreadPoolExecutor
 
 # ========================== CONFIGURATION ==========================
 
 # Serial port (None = auto-detect)
 SERIAL_PORT = "/dev/cu.usbmodemFFFFFFFEFFFF1"
 
+# Auto-detection: match the STMicro USB vendor ID directly and remember
+# the last working port so later runs skip enumeration entirely
+VID_STM = 0x0483
+PORT_CACHE_FILE = os.path.expanduser("~/.sensortile_port")
+_DESC_RE = re.compile(r'STM|CDC|usbmodem', re.I)
+
 # CSV file settings
 CSV_FILENAME = "sensor_data_" + datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + ".csv"
+BATCH_ROWS = 128            # Rows buffered before a single writerows() call
+FLUSH_EVERY_BATCHES = 32    # Flush to disk every N drained batches (~4k samples)
 
 # Email configuration
 EMAIL_ENABLED = True  # Set True to enable
@@ -48,7 +62,6 @@ RECIPIENT_EMAILS = ["rouban.01@wipro.com","parkinzyt@gmail.com"]
 class SensorLogger:
     def __init__(self):
         self.csv_file = None
-        self.csv_writer = None
         self.serial_port = None
         self.running = False
         self.stop_event = Event()
@@ -57,72 +70,128 @@ class SensorLogger:
         self.mode = None  # 'raw' or 'reduced'
         self.csv_initialized = False
         self.data_buffer = []  # Buffer for incremental email
+        self._row_buf = []  # Rows pending a batched write
+        self._batches_written = 0
+        self._row_fmt = None  # Preformatted row template, set by init_csv
+        self._raw_row = [0] * 20  # x,y,z + 16 mic + timestamp, reused per sample
+        # Single worker so sends never overlap and SMTP latency stays off
+        # the scheduler/reader threads
+        self._mail_pool = ThreadPoolExecutor(max_workers=1)
+        # Wall-clock anchor + monotonic base, captured at stream start
+        self.t0_wall_ns = 0
+        self.t0_mono_ns = 0
         
     def find_sensortile(self):
-        """Auto-detect SensorTile USB port."""
+        """Auto-detect SensorTile USB port (VID match, cached between runs)."""
+        # Cached port from a previous run skips enumeration entirely
+        try:
+            with open(PORT_CACHE_FILE) as f:
+                cached = json.load(f)["device"]
+            if os.path.exists(cached):
+                return cached
+        except (OSError, ValueError, KeyError):
+            pass
+
+        device = None
         ports = serial.tools.list_ports.comports()
         for port in ports:
-            desc = port.description.upper()
-            if "STM" in desc or "CDC" in desc or "usbmodem" in port.device.lower():
-                return port.device
-        return None
+            # STMicro VID: a single integer compare per port
+            if port.vid == VID_STM:
+                device = port.device
+                break
+        if device is None:
+            # Fall back to description matching for adapters that
+            # re-enumerate under another VID (case-insensitive regex --
+            # no per-port upper()/lower() copies)
+            for port in ports:
+                if _DESC_RE.search(port.description) or _DESC_RE.search(port.device):
+                    device = port.device
+                    break
+
+        if device:
+            try:
+                with open(PORT_CACHE_FILE, 'w') as f:
+                    json.dump({"device": device}, f)
+            except OSError:
+                pass
+        return device
     
     def init_csv(self, mode):
         """Initialize CSV file with headers based on mode."""
         if self.csv_initialized:
             return
             
-        self.csv_file = open(CSV_FILENAME, 'w', newline='')
-        self.csv_writer = csv.writer(self.csv_file)
+        # Raw append-mode fd behind a 1 MiB BufferedWriter: rows are
+        # written as pre-joined UTF-8 bytes, saving the text layer's
+        # str->bytes encode pass on every write
+        fd = os.open(CSV_FILENAME, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.csv_file = os.fdopen(fd, 'wb', buffering=1 << 20)
         
         if mode == 'raw':
-            # x,y,z + 16 mic samples + timestamp
-            headers = ["x", "y", "z"] + [f"m{i+1}" for i in range(16)] + ["timestamp"]
+            # x,y,z + 16 mic samples + epoch-ns timestamp
+            headers = ["x", "y", "z"] + [f"m{i+1}" for i in range(16)] + ["timestamp_ns"]
         else:
-            # x,y,z,peak,avg + timestamp
-            headers = ["x", "y", "z", "mic_peak", "mic_avg", "timestamp"]
-        
-        self.csv_writer.writerow(headers)
+            # x,y,z,peak,avg + epoch-ns timestamp
+            headers = ["x", "y", "z", "mic_peak", "mic_avg", "timestamp_ns"]
+
+        # Headers are plain identifiers and data rows are plain ints, so
+        # nothing ever needs csv quoting -- join and encode directly
+        self.csv_file.write((",".join(headers) + "\r\n").encode())
+        self._row_fmt = ",".join(["{}"] * len(headers)) + "\r\n"
         self.csv_file.flush()
         self.csv_initialized = True
         print(f"[CSV] Headers: {headers}")
     
     def write_sample(self, row):
-        """Write a sample to CSV and buffer for email."""
-        self.csv_writer.writerow(row)
+        """Buffer a sample; rows hit the CSV in batches of BATCH_ROWS."""
+        self._row_buf.append(row)
         self.data_buffer.append(row)  # Keep for incremental email
         self.sample_count += 1
+        if len(self._row_buf) >= BATCH_ROWS:
+            self._drain_rows()
         if self.sample_count % 500 == 0:
-            self.csv_file.flush()
             print(f"[LOG] {self.sample_count} samples")
+
+    def _drain_rows(self):
+        """Format and write buffered rows in one call, flushing periodically."""
+        if not self._row_buf:
+            return
+        fmt = self._row_fmt
+        self.csv_file.write("".join([fmt.format(*row) for row in self._row_buf]).encode())
+        self._row_buf.clear()
+        self._batches_written += 1
+        if self._batches_written % FLUSH_EVERY_BATCHES == 0:
+            self.csv_file.flush()
     
     def send_email(self):
-        """Send incremental CSV data via email."""
+        """Send incremental CSV data via email (runs on the mail worker)."""
         if not EMAIL_ENABLED or not RECIPIENT_EMAILS:
             return
-        
-        # Check if there's new data since last email
+
+        # Snapshot the pending rows; the reader keeps appending past this
+        # point without ever waiting on SMTP
         new_samples = len(self.data_buffer)
         if new_samples == 0:
             print("[EMAIL] No new data to send")
             return
-        
+        snapshot = self.data_buffer[:new_samples]
+
         try:
             # Create incremental CSV file
             start_sample = self.last_email_count + 1
-            end_sample = self.sample_count
+            end_sample = self.last_email_count + new_samples
             incremental_filename = f"sensor_data_{start_sample}-{end_sample}.csv"
-            
+
             with open(incremental_filename, 'w', newline='') as f:
                 writer = csv.writer(f)
                 # Write headers
                 if self.mode == 'raw':
-                    headers = ["x", "y", "z"] + [f"m{i+1}" for i in range(16)] + ["timestamp"]
+                    headers = ["x", "y", "z"] + [f"m{i+1}" for i in range(16)] + ["timestamp_ns"]
                 else:
-                    headers = ["x", "y", "z", "mic_peak", "mic_avg", "timestamp"]
+                    headers = ["x", "y", "z", "mic_peak", "mic_avg", "timestamp_ns"]
                 writer.writerow(headers)
-                # Write buffered data
-                for row in self.data_buffer:
+                # Write snapshotted data
+                for row in snapshot:
                     writer.writerow(row)
             
             msg = MIMEMultipart()
@@ -140,13 +209,22 @@ Total Samples: {self.sample_count}
 """
             msg.attach(MIMEText(body, 'plain'))
             
-            # Attach incremental CSV
-            with open(incremental_filename, 'rb') as f:
-                part = MIMEBase('application', 'octet-stream')
+            # Compress before attaching: CSV of ints shrinks ~5-10x, so
+            # the base64 payload and the SMTP upload stay small. Level 3
+            # trades a little ratio for ~3x faster compression, and the
+            # chunked copy keeps memory flat regardless of file size.
+            gz_filename = incremental_filename + ".gz"
+            with open(incremental_filename, 'rb') as f, \
+                 gzip.open(gz_filename, 'wb', compresslevel=3) as g:
+                shutil.copyfileobj(f, g, length=1 << 20)
+
+            # Attach compressed incremental CSV
+            with open(gz_filename, 'rb') as f:
+                part = MIMEBase('application', 'gzip')
                 part.set_payload(f.read())
                 encoders.encode_base64(part)
-                part.add_header('Content-Disposition', 
-                                f'attachment; filename="{incremental_filename}"')
+                part.add_header('Content-Disposition',
+                                f'attachment; filename="{gz_filename}"')
                 msg.attach(part)
             
             server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
@@ -155,12 +233,14 @@ Total Samples: {self.sample_count}
             server.send_message(msg)
             server.quit()
             
-            # Clear buffer and update counter after successful send
-            self.last_email_count = self.sample_count
-            self.data_buffer.clear()
+            # Drop only the sent rows; anything appended during the send
+            # stays queued for the next email
+            self.last_email_count = end_sample
+            del self.data_buffer[:new_samples]
             
-            # Remove temp file
+            # Remove temp files
             os.remove(incremental_filename)
+            os.remove(gz_filename)
             
             print(f"[EMAIL] Sent samples {start_sample}-{end_sample} to {len(RECIPIENT_EMAILS)} recipient(s)")
             
@@ -172,16 +252,16 @@ Total Samples: {self.sample_count}
         interval = EMAIL_INTERVAL_MINUTES * 60
         while not self.stop_event.wait(interval):
             if self.running:
-                self.send_email()
+                self._mail_pool.submit(self.send_email)
     
-    def process_line(self, line):
-        """Parse serial line and log to CSV."""
-        # Skip debug messages
-        if line.startswith('#'):
-            print(f"[DEBUG] {line}")
+    def process_line(self, raw):
+        """Parse a raw serial line (bytes) and log to CSV."""
+        # Skip debug messages (only these ever need decoding)
+        if raw[:1] == b'#':
+            print(f"[DEBUG] {raw.decode('utf-8', 'replace')}")
             return
-        
-        parts = line.split(',')
+
+        parts = raw.split(b',')
         if len(parts) < 5:
             return
         
@@ -189,7 +269,9 @@ Total Samples: {self.sample_count}
             # Parse accel
             x, y, z = int(parts[0]), int(parts[1]), int(parts[2])
             mic_parts = parts[3:]
-            timestamp = datetime.now().isoformat()
+            # Epoch-ns from the monotonic clock: integer math only, no
+            # datetime object or strftime per sample
+            timestamp = self.t0_wall_ns + (time.monotonic_ns() - self.t0_mono_ns)
             
             # Detect mode from mic data count
             if len(mic_parts) == 2:
@@ -209,11 +291,19 @@ Total Samples: {self.sample_count}
                     self.init_csv('raw')
                     print(f"[MODE] Detected RAW ({len(mic_parts)} samples)")
                 
-                mic_samples = [int(m) for m in mic_parts[:16]]
-                # Pad if less than 16
-                while len(mic_samples) < 16:
-                    mic_samples.append(0)
-                self.write_sample([x, y, z] + mic_samples + [timestamp])
+                # Overwrite the reusable row in place, then hand a copy
+                # to write_sample (the buffers keep references) -- one
+                # allocation per sample instead of building and
+                # concatenating three lists
+                r = self._raw_row
+                r[0], r[1], r[2] = x, y, z
+                n = min(16, len(mic_parts))
+                for i in range(n):
+                    r[3 + i] = int(mic_parts[i])
+                for i in range(n, 16):
+                    r[3 + i] = 0
+                r[19] = timestamp
+                self.write_sample(r.copy())
                 
         except ValueError:
             pass
@@ -231,33 +321,64 @@ Total Samples: {self.sample_count}
         print("[START] Waiting for data to detect mode...")
         
         self.serial_port = serial.Serial(port, 115200, timeout=1)
+        # Ask the kernel to deliver bytes as they arrive instead of
+        # batching up to 16ms (ASYNC_LOW_LATENCY ioctl on Linux; the
+        # equivalent of `setserial /dev/ttyUSBx low_latency`)
+        try:
+            self.serial_port.set_low_latency_mode(True)
+        except (NotImplementedError, ValueError, IOError):
+            pass  # Not supported on this platform/driver
+        # Windows: enlarge the driver RX buffer
+        try:
+            self.serial_port.set_buffer_size(rx_size=1 << 16)
+        except (AttributeError, NotImplementedError, IOError):
+            pass
         self.running = True
+        self.t0_wall_ns = time.time_ns()
+        self.t0_mono_ns = time.monotonic_ns()
         
         # Start email scheduler
         if EMAIL_ENABLED:
             Thread(target=self.email_scheduler, daemon=True).start()
         
-        # Main loop
+        # Main loop: wait for the serial fd to become readable (epoll on
+        # Linux, kqueue on macOS) instead of blocking inside pyserial's
+        # read -- the GIL is released cleanly while idle, then one
+        # os.read drains whatever arrived
+        sel = selectors.DefaultSelector()
+        serial_fd = self.serial_port.fileno()
+        sel.register(serial_fd, selectors.EVENT_READ)
+        buf = bytearray()
         try:
             while True:
-                line = self.serial_port.readline()
-                if not line:
+                if not sel.select(0.1):
                     continue
-                try:
-                    text = line.decode('utf-8').strip()
-                    if text:
-                        self.process_line(text)
-                except UnicodeDecodeError:
-                    pass
+                chunk = os.read(serial_fd, 4096)
+                if not chunk:
+                    # Readable fd + empty read means the device hung up
+                    # (unplugged); stop so the finally block drains the
+                    # row buffer and closes the CSV instead of spinning
+                    print("[ERROR] Serial device disconnected")
+                    break
+                buf += chunk
+
+                while (nl := buf.find(b'\n')) != -1:
+                    raw = bytes(buf[:nl]).strip()
+                    del buf[:nl + 1]
+                    if raw:
+                        self.process_line(raw)
                     
         except KeyboardInterrupt:
             print("\n[STOP] Shutting down...")
         finally:
             self.running = False
             self.stop_event.set()
+            self._mail_pool.shutdown(wait=False)
+            sel.close()
             if self.serial_port:
                 self.serial_port.close()
             if self.csv_file:
+                self._drain_rows()
                 self.csv_file.close()
             print(f"[DONE] {self.sample_count} samples saved to {CSV_FILENAME}")
 
@@ -5,13 +5,19 @@ SensorTile → HiveMQ MQTT Gateway (Secure TLS Connection)
 Reads sensor data from SensorTile USB CDC and publishes to HiveMQ Cloud
 over MQTTS (TLS encrypted, port 8883).
 
+Everything runs on a single asyncio event loop: serial reads arrive via
+pyserial-asyncio's protocol callback, the window flusher and the MQTT
+publisher are coroutines, and aiomqtt drives the broker connection. No
+reader/publisher threads means no GIL contention or context-switch
+latency spikes between them.
+
 DATA FORMAT FROM SENSORTILE:
   Accelerometer: "A,x,y,z\n"           @ 1kHz
   Microphone:    "M,v1,v2,...,v128\n"  @ 125 lines/sec (128 samples each)
 
 MQTT TOPICS:
-  switchgear/accel    - JSON: {"x": int, "y": int, "z": int, "t": float}
-  switchgear/mic      - JSON: {"samples": [128 ints], "batch": int, "t": float}
+  switchgear/combined - JSON per 10ms window:
+                        {"accel": [[x, y, z, t], ...], "mic": [{...}, ...]}
   switchgear/status   - Connection status and diagnostics
 
 USAGE:
@@ -24,16 +30,34 @@ Author: SensorTile Condition Monitoring Project
 Date: February 2026
 """
 
+import asyncio
 import serial
 import serial.tools.list_ports
 import ssl
 import json
+import os
+import re
 import time
 import sys
 from datetime import datetime
 
-# pip install paho-mqtt
-import paho.mqtt.client as mqtt
+# pip install pyserial-asyncio
+import serial_asyncio
+
+# pip install aiomqtt
+import aiomqtt
+
+# pip install numpy
+import numpy as np
+
+# pip install orjson
+import orjson
+
+# pip install numba  (optional: JIT-compiles the mic parser)
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
 # ========================== CONFIGURATION ==========================
 
@@ -44,228 +68,404 @@ MQTT_USERNAME = "wipro"
 MQTT_PASSWORD = "wiproMQTT1"
 
 # MQTT Topics
-TOPIC_ACCEL = "switchgear/accel"
-TOPIC_MIC = "switchgear/mic"
+TOPIC_COMBINED = "switchgear/combined"
 TOPIC_STATUS = "switchgear/status"
 
 # Serial port (auto-detect or specify manually)
 SERIAL_PORT = "/dev/cu.usbmodemFFFFFFFEFFFF1"  # SensorTile CDC port
 SERIAL_BAUD = 115200  # Not used for USB CDC, but required by pyserial
 
-# Publish rate limiting (to avoid overwhelming MQTT)
-ACCEL_PUBLISH_INTERVAL = 0.01   # Publish every 10ms (100 Hz max)
-MIC_PUBLISH_EVERY_N = 1         # Publish every Nth mic batch (1 = all)
-
-# ========================== MQTT CALLBACKS ==========================
-
-def on_connect(client, userdata, flags, rc, properties=None):
-    """Called when connected to MQTT broker."""
-    if rc == 0:
-        print(f"[MQTT] ✅ Connected to {MQTT_BROKER}")
-        # Publish connection status
-        status = {
-            "status": "online",
-            "device": "SensorTile",
-            "timestamp": datetime.now().isoformat()
-        }
-        client.publish(TOPIC_STATUS, json.dumps(status), retain=True)
-    else:
-        print(f"[MQTT] ❌ Connection failed with code {rc}")
-        if rc == 5:
-            print("       Check username/password!")
-
-def on_disconnect(client, userdata, rc, properties=None):
-    """Called when disconnected from MQTT broker."""
-    print(f"[MQTT] Disconnected (rc={rc})")
-
-def on_publish(client, userdata, mid, properties=None):
-    """Called when message is published (optional debug)."""
-    pass  # Uncomment for debug: print(f"[MQTT] Published mid={mid}")
+# Auto-detection: match the STMicro USB vendor ID directly and remember
+# the last working port so later runs skip enumeration entirely
+VID_STM = 0x0483
+PORT_CACHE_FILE = os.path.expanduser("~/.sensortile_port")
+_DESC_RE = re.compile(r'STM|CDC|usbmodem', re.I)
+
+# Publish batching: accel samples and mic batches accumulate for one
+# window, then go out as a single combined message (one TLS record per
+# window instead of one per sample/batch)
+COMBINED_FLUSH_INTERVAL = 0.01  # Window length in seconds (10ms)
+MIC_PUBLISH_EVERY_N = 1         # Include every Nth mic batch (1 = all)
+
+# Outgoing messages queued for the publisher coroutine (drop when full
+# so the serial protocol callback never blocks on TLS writes)
+PUBLISH_QUEUE_SIZE = 1024
+
+# Interval between [STATS] progress lines
+STATS_INTERVAL = 5.0
+
+# Payload shapes never change, so the JSON envelopes are fixed bytes
+# templates -- only the samples array goes through a serializer, no
+# per-batch dict build. Mic entries are template-built bytes that the
+# flusher splices into the combined envelope unparsed.
+MIC_PAYLOAD_TEMPLATE = b'{"samples":%b,"batch":%d,"t":%.4f,"ts":%d}'
+COMBINED_PAYLOAD_TEMPLATE = b'{"accel":%b,"mic":[%b]}'
+
+# ========================== MIC LINE PARSER ==========================
+
+if njit is not None:
+    @njit(cache=True)
+    def _parse_mic_digits(buf):
+        """Scan ASCII digits/commas into int32 samples in one compiled loop.
+
+        Returns an empty array on malformed input -- an unexpected byte,
+        an empty field, or more values than the output buffer holds --
+        so the caller counts it as an error, matching the fallback path
+        where int() raises ValueError. The explicit bounds check matters:
+        numba compiles without one, so an oversized line (e.g. two mic
+        lines merged by a lost newline) would otherwise write past the
+        buffer into native memory.
+        """
+        out = np.empty(256, dtype=np.int32)
+        n = 0
+        val = 0
+        neg = False
+        seen = False
+        done = False  # Value terminated by trailing whitespace
+        for i in range(buf.shape[0]):
+            c = int(buf[i])
+            if 48 <= c <= 57:  # '0'-'9'
+                if done:
+                    return out[:0]
+                val = val * 10 + (c - 48)
+                seen = True
+            elif c == 44:  # ','
+                if not seen or n >= out.shape[0]:
+                    return out[:0]
+                out[n] = -val if neg else val
+                n += 1
+                val = 0
+                neg = False
+                seen = False
+                done = False
+            elif c == 45 and not neg and not seen and not done:  # leading '-'
+                neg = True
+            elif c == 32 or c == 9:  # whitespace around a value, as int() allows
+                if seen:
+                    done = True
+                elif neg:
+                    return out[:0]
+            else:
+                return out[:0]
+        if not seen or n >= out.shape[0]:
+            return out[:0]
+        out[n] = -val if neg else val
+        n += 1
+        return out[:n]
+
+    def parse_mic(payload):
+        """Parse b'v1,v2,...' into an int32 ndarray (Numba fast path)."""
+        return _parse_mic_digits(np.frombuffer(payload, dtype=np.uint8))
+else:
+    def parse_mic(payload):
+        """Parse b'v1,v2,...' into an int32 ndarray (numpy fallback)."""
+        return np.array(payload.split(b','), dtype=np.int32)
+
+# ========================== SERIAL PROTOCOL ==========================
+
+class SensorTileProtocol(asyncio.Protocol):
+    """Parses serial bytes into the accel/mic accumulation windows.
+
+    data_received appends raw chunks to a bytearray and carves complete
+    lines off the front -- the same splitter the threaded loop used,
+    just driven by the event loop instead of select().
+    """
+
+    def __init__(self, pending_accel, pending_mic, stats, disconnected):
+        self.pending_accel = pending_accel
+        self.pending_mic = pending_mic
+        self.stats = stats
+        self.disconnected = disconnected  # Event set when the link drops
+        self.buf = bytearray()
+        self.accel_idx = 0
+        self.mic_batch = 0
+        # Wall-clock anchor + monotonic base: timestamps are integer
+        # epoch-ns (no per-sample datetime object or strftime)
+        self.t0_wall_ns = time.time_ns()
+        self.t0_mono_ns = time.monotonic_ns()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # Ask the kernel to deliver bytes as they arrive instead of
+        # batching up to 16ms (ASYNC_LOW_LATENCY ioctl on Linux; same
+        # effect as `setserial /dev/ttyUSBx low_latency`)
+        try:
+            transport.serial.set_low_latency_mode(True)
+        except (NotImplementedError, ValueError, IOError):
+            pass  # Not supported on this platform/driver
+        print(f"[SERIAL] ✅ Connected to {transport.serial.port}")
+
+    def connection_lost(self, exc):
+        print(f"[SERIAL] Connection lost: {exc}")
+        # Wake main so the gateway shuts down instead of idling forever
+        # with a dead serial link
+        self.disconnected.set()
+
+    def data_received(self, data):
+        buf = self.buf
+        buf += data
+        while (nl := buf.find(b'\n')) != -1:
+            line = bytes(buf[:nl]).strip()
+            del buf[:nl + 1]
+            if line:
+                self.handle_line(line)
+
+    def handle_line(self, line):
+        """Parse one line straight from bytes into the current window."""
+        # ---- Accelerometer: A,x,y,z ----
+        if line[:2] == b'A,':
+            try:
+                _, xs, ys, zs = line.split(b',')
+                x, y, z = int(xs), int(ys), int(zs)
+                t = self.accel_idx / 1000.0  # Time in seconds (1kHz)
+                self.accel_idx += 1
+
+                # Every sample lands in the current window; the flusher
+                # publishes the whole window at once, so no rate
+                # limiting (or dropped samples) needed
+                self.pending_accel.append((x, y, z, round(t, 3)))
+                self.stats["accel"] += 1
+
+            except ValueError:
+                self.stats["errors"] += 1
+
+        # ---- Microphone: M,v1,v2,...,v128 ----
+        elif line[:2] == b'M,':
+            try:
+                # Compiled digit scan over the raw payload (no
+                # 129-element split, no per-value int() calls)
+                samples = parse_mic(line[2:])
+                if samples.size == 0:
+                    self.stats["errors"] += 1
+                    return
+                t = (self.mic_batch * 128) / 16000.0  # Time in seconds (16kHz)
+
+                # Include every Nth batch in the current window
+                if self.mic_batch % MIC_PUBLISH_EVERY_N == 0:
+                    # Known-shape payload: %-format the fixed envelope
+                    # and let orjson serialize only the int32 ndarray
+                    entry = MIC_PAYLOAD_TEMPLATE % (
+                        orjson.dumps(samples, option=orjson.OPT_SERIALIZE_NUMPY),
+                        self.mic_batch,
+                        t,
+                        self.t0_wall_ns + (time.monotonic_ns() - self.t0_mono_ns),
+                    )
+                    self.pending_mic.append(entry)
+                    self.stats["mic"] += 1
+
+                self.mic_batch += 1
+
+            except ValueError:
+                self.stats["errors"] += 1
+
+        # ---- Firmware debug: #... ----
+        elif line[:1] == b'#':
+            # Debug lines are the only ones that ever get decoded
+            print(f"[DEBUG] {line.decode('utf-8', 'replace')}")
+
+# ========================== COROUTINES ==========================
+
+async def combined_flusher(pub_q, pending_accel, pending_mic, stats):
+    """Flush each 10ms accumulation window as one combined publish.
+
+    Coalescing cuts ~225 TLS records/s (100 accel + 125 mic) down to at
+    most 100/s while retaining every sample.
+    """
+    while True:
+        await asyncio.sleep(COMBINED_FLUSH_INTERVAL)
+        na = len(pending_accel)
+        nm = len(pending_mic)
+        if not na and not nm:
+            continue
+        accel = pending_accel[:na]
+        del pending_accel[:na]
+        mic = pending_mic[:nm]
+        del pending_mic[:nm]
+        payload = COMBINED_PAYLOAD_TEMPLATE % (orjson.dumps(accel), b','.join(mic))
+        try:
+            pub_q.put_nowait((TOPIC_COMBINED, payload))
+        except asyncio.QueueFull:
+            stats["dropped"] += 1
+
+async def publisher_loop(client, pub_q):
+    """Drain the publish queue into the broker connection."""
+    while True:
+        topic, payload = await pub_q.get()
+        await client.publish(topic, payload, qos=0)
+
+async def stats_reporter(stats):
+    """Print a progress line every STATS_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        if stats["accel"] or stats["mic"]:
+            print(f"[STATS] Accel: {stats['accel']} | Mic: {stats['mic']} | "
+                  f"Errors: {stats['errors']} | Dropped: {stats['dropped']}")
 
 # ========================== SERIAL PORT DETECTION ==========================
 
 def find_sensortile_port():
-    """Auto-detect SensorTile USB CDC port."""
+    """Auto-detect SensorTile USB CDC port (VID match, cached between runs)."""
+    # Cached port from a previous run skips enumeration entirely
+    try:
+        with open(PORT_CACHE_FILE) as f:
+            cached = json.load(f)["device"]
+        if os.path.exists(cached):
+            print(f"[SERIAL] Using cached port: {cached}")
+            return cached
+    except (OSError, ValueError, KeyError):
+        pass
+
     ports = serial.tools.list_ports.comports()
-    
+
     for port in ports:
-        # Look for STM32 CDC device
-        if "STM" in port.description.upper() or \
-           "CDC" in port.description.upper() or \
-           "usbmodem" in port.device.lower():
+        # STMicro VID: a single integer compare per port
+        if port.vid == VID_STM:
             print(f"[SERIAL] Found: {port.device} - {port.description}")
+            _cache_port(port.device)
             return port.device
-    
+
+    for port in ports:
+        # Fall back to description matching for adapters that
+        # re-enumerate under another VID (case-insensitive regex --
+        # no per-port upper()/lower() copies)
+        if _DESC_RE.search(port.description) or _DESC_RE.search(port.device):
+            print(f"[SERIAL] Found: {port.device} - {port.description}")
+            _cache_port(port.device)
+            return port.device
+
     # List all available ports
     print("[SERIAL] Available ports:")
     for port in ports:
         print(f"         {port.device}: {port.description}")
-    
+
     return None
 
+def _cache_port(device):
+    """Remember a detected port for the next run."""
+    try:
+        with open(PORT_CACHE_FILE, 'w') as f:
+            json.dump({"device": device}, f)
+    except OSError:
+        pass
+
 # ========================== MAIN GATEWAY ==========================
 
-def main():
+async def main():
     print("=" * 60)
     print("  SensorTile → HiveMQ MQTT Gateway (TLS Secured)")
     print("=" * 60)
-    
+
     # Validate configuration
     if "your-cluster" in MQTT_BROKER or "your-username" in MQTT_USERNAME:
         print("\n❌ ERROR: Please configure HiveMQ credentials!")
         print("   Edit the MQTT_BROKER, MQTT_USERNAME, MQTT_PASSWORD")
         print("   at the top of this file.\n")
         sys.exit(1)
-    
-    # -------- Setup MQTT Client with TLS --------
-    print(f"\n[MQTT] Connecting to {MQTT_BROKER}:{MQTT_PORT} (TLS)...")
-    
-    # Use MQTT v5 for better features
-    client = mqtt.Client(
-        client_id=f"sensortile-gateway-{int(time.time())}",
-        protocol=mqtt.MQTTv5
-    )
-    
-    # Set credentials
-    client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-    
-    # Enable TLS (HiveMQ Cloud uses standard CA certificates)
-    client.tls_set(
-        ca_certs=None,  # Use system CA store
-        certfile=None,
-        keyfile=None,
-        cert_reqs=ssl.CERT_REQUIRED,
-        tls_version=ssl.PROTOCOL_TLS,
-        ciphers=None
-    )
-    
-    # Set callbacks
-    client.on_connect = on_connect
-    client.on_disconnect = on_disconnect
-    client.on_publish = on_publish
-    
-    # Set Last Will (published if we disconnect unexpectedly)
-    will_msg = json.dumps({"status": "offline", "timestamp": datetime.now().isoformat()})
-    client.will_set(TOPIC_STATUS, will_msg, retain=True)
-    
-    # Connect
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
-    except Exception as e:
-        print(f"[MQTT] ❌ Connection failed: {e}")
-        sys.exit(1)
-    
-    # Start MQTT network loop in background thread
-    client.loop_start()
-    
+
     # -------- Setup Serial Port --------
     port = SERIAL_PORT or find_sensortile_port()
     if not port:
         print("\n❌ ERROR: SensorTile not found!")
         print("   Connect SensorTile via USB and try again.\n")
-        client.loop_stop()
         sys.exit(1)
-    
-    print(f"[SERIAL] Opening {port}...")
-    try:
-        ser = serial.Serial(port, SERIAL_BAUD, timeout=1)
-    except Exception as e:
-        print(f"[SERIAL] ❌ Failed to open port: {e}")
-        client.loop_stop()
-        sys.exit(1)
-    
-    print(f"[SERIAL] ✅ Connected to {port}")
-    
-    # -------- Main Loop: Read Serial → Publish MQTT --------
-    print("\n[GATEWAY] 🚀 Streaming started! Press Ctrl+C to stop.\n")
-    
-    accel_idx = 0
-    mic_batch = 0
-    last_accel_publish = 0
-    stats = {"accel": 0, "mic": 0, "errors": 0}
-    
+
+    # Shared state between the protocol and the flusher (same event
+    # loop, so no locking needed)
+    pending_accel = []
+    pending_mic = []
+    stats = {"accel": 0, "mic": 0, "errors": 0, "dropped": 0}
+    pub_q = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+    disconnected = asyncio.Event()
+
+    # -------- Connect MQTT (TLS) and stream --------
+    print(f"\n[MQTT] Connecting to {MQTT_BROKER}:{MQTT_PORT} (TLS)...")
+
+    # Last Will (published if we disconnect unexpectedly)
+    will = aiomqtt.Will(
+        TOPIC_STATUS,
+        json.dumps({"status": "offline", "timestamp": datetime.now().isoformat()}),
+        retain=True
+    )
+
     try:
-        while True:
-            line = ser.readline()
-            if not line:
-                continue
-            
+        async with aiomqtt.Client(
+            hostname=MQTT_BROKER,
+            port=MQTT_PORT,
+            username=MQTT_USERNAME,
+            password=MQTT_PASSWORD,
+            identifier=f"sensortile-gateway-{int(time.time())}",
+            tls_params=aiomqtt.TLSParameters(
+                ca_certs=None,  # Use system CA store
+                cert_reqs=ssl.CERT_REQUIRED,
+                tls_version=ssl.PROTOCOL_TLS
+            ),
+            will=will,
+            keepalive=60
+        ) as client:
+            print(f"[MQTT] ✅ Connected to {MQTT_BROKER}")
+            status = {
+                "status": "online",
+                "device": "SensorTile",
+                "timestamp": datetime.now().isoformat()
+            }
+            await client.publish(TOPIC_STATUS, json.dumps(status), retain=True)
+
+            loop = asyncio.get_running_loop()
+            print(f"[SERIAL] Opening {port}...")
             try:
-                line = line.decode('utf-8').strip()
-            except UnicodeDecodeError:
-                stats["errors"] += 1
-                continue
-            
-            if not line:
-                continue
-            
-            parts = line.split(',')
-            
-            # ---- Accelerometer: A,x,y,z ----
-            if parts[0] == 'A' and len(parts) == 4:
-                try:
-                    x, y, z = int(parts[1]), int(parts[2]), int(parts[3])
-                    t = accel_idx / 1000.0  # Time in seconds (1kHz)
-                    accel_idx += 1
-                    
-                    # Rate limit publishing
-                    now = time.time()
-                    if now - last_accel_publish >= ACCEL_PUBLISH_INTERVAL:
-                        payload = json.dumps({
-                            "x": x, "y": y, "z": z,
-                            "t": round(t, 3),
-                            "ts": datetime.now().isoformat()
-                        })
-                        client.publish(TOPIC_ACCEL, payload, qos=0)
-                        last_accel_publish = now
-                        stats["accel"] += 1
-                        
-                except ValueError:
-                    stats["errors"] += 1
-            
-            # ---- Microphone: M,v1,v2,...,v128 ----
-            elif parts[0] == 'M' and len(parts) > 1:
+                transport, _protocol = await serial_asyncio.create_serial_connection(
+                    loop,
+                    lambda: SensorTileProtocol(pending_accel, pending_mic, stats, disconnected),
+                    port,
+                    baudrate=SERIAL_BAUD
+                )
+            except Exception as e:
+                print(f"[SERIAL] ❌ Failed to open port: {e}")
+                sys.exit(1)
+
+            print("\n[GATEWAY] 🚀 Streaming started! Press Ctrl+C to stop.\n")
+
+            tasks = [
+                asyncio.create_task(combined_flusher(pub_q, pending_accel, pending_mic, stats)),
+                asyncio.create_task(publisher_loop(client, pub_q)),
+                asyncio.create_task(stats_reporter(stats)),
+            ]
+            serial_lost = asyncio.create_task(disconnected.wait())
+            try:
+                # Run until the serial link drops or a worker task fails
+                done, _ = await asyncio.wait(
+                    [serial_lost, *tasks],
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    task.result()  # Surface worker exceptions
+            finally:
+                for task in (serial_lost, *tasks):
+                    task.cancel()
+                transport.close()
+                status = json.dumps({
+                    "status": "offline",
+                    "timestamp": datetime.now().isoformat()
+                })
+                # Best effort on the way out; the Last Will covers any
+                # disconnect this publish does not reach
                 try:
-                    samples = [int(v) for v in parts[1:]]
-                    t = (mic_batch * 128) / 16000.0  # Time in seconds (16kHz)
-                    
-                    # Publish every Nth batch
-                    if mic_batch % MIC_PUBLISH_EVERY_N == 0:
-                        payload = json.dumps({
-                            "samples": samples,
-                            "batch": mic_batch,
-                            "t": round(t, 4),
-                            "ts": datetime.now().isoformat()
-                        })
-                        client.publish(TOPIC_MIC, payload, qos=0)
-                        stats["mic"] += 1
-                    
-                    mic_batch += 1
-                    
-                except ValueError:
-                    stats["errors"] += 1
-            
-            # ---- Stats every 5 seconds ----
-            if (stats["accel"] + stats["mic"]) % 500 == 0 and stats["accel"] > 0:
-                print(f"[STATS] Accel: {stats['accel']} | Mic: {stats['mic']} | Errors: {stats['errors']}")
-    
-    except KeyboardInterrupt:
-        print("\n\n[GATEWAY] Shutting down...")
-    
-    finally:
-        # Cleanup
-        status = json.dumps({"status": "offline", "timestamp": datetime.now().isoformat()})
-        client.publish(TOPIC_STATUS, status, retain=True)
-        time.sleep(0.5)  # Let message send
-        
-        ser.close()
-        client.loop_stop()
-        client.disconnect()
-        
-        print(f"[STATS] Final - Accel: {stats['accel']} | Mic: {stats['mic']} | Errors: {stats['errors']}")
-        print("[GATEWAY] Goodbye! 👋")
+                    await client.publish(TOPIC_STATUS, status, retain=True)
+                except (aiomqtt.MqttError, asyncio.CancelledError):
+                    pass
+                print(f"[STATS] Final - Accel: {stats['accel']} | Mic: {stats['mic']} | "
+                      f"Errors: {stats['errors']} | Dropped: {stats['dropped']}")
+            if disconnected.is_set():
+                print("\n❌ ERROR: Serial connection lost!")
+                sys.exit(1)
+    except aiomqtt.MqttError as e:
+        print(f"[MQTT] ❌ Connection failed: {e}")
+        sys.exit(1)
 
 # ========================== ENTRY POINT ==========================
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n\n[GATEWAY] Goodbye! 👋")